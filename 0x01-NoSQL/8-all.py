@@ -1,18 +1,32 @@
 #!/usr/bin/env python3
 """
-This module provides a function to list all documents in a MongoDB collection.
+This module provides functions to list all documents in a MongoDB collection.
 """
 
 
-def list_all(mongo_collection):
+def iter_all(mongo_collection, projection=None, batch_size=1000):
+    """
+    Yields all documents in a MongoDB collection.
+
+    :param mongo_collection: A pymongo collection object
+    :param projection: Optional fields to return, e.g.
+        {"_id": 0, "name": 1}, which also skips decoding the others
+    :param batch_size: Number of documents fetched per round-trip
+    :return: A generator over the documents in the collection
+    """
+    yield from mongo_collection.find(
+        projection=projection, batch_size=batch_size
+    )
+
+
+def list_all(mongo_collection, projection=None, batch_size=1000):
     """
     Lists all documents in a MongoDB collection.
 
     :param mongo_collection: A pymongo collection object
+    :param projection: Optional fields to return, e.g.
+        {"_id": 0, "name": 1}, which also skips decoding the others
+    :param batch_size: Number of documents fetched per round-trip
     :return: A list of all documents in the collection
     """
-    documents = mongo_collection.find()
-    
-    # Convert cursor to list directly, no need to check count
-    return list(documents)
-
+    return list(iter_all(mongo_collection, projection, batch_size))
@@ -1,9 +1,35 @@
 #!/usr/bin/env python3
 """
-This module provides a function to insert a document into a MongoDB collection.
+This module provides functions to insert documents into a MongoDB collection.
 """
 
 
+def insert_schools(mongo_collection, docs):
+    """
+    Inserts several documents in a MongoDB collection in one round-trip.
+
+    :param mongo_collection: A pymongo collection object
+    :param docs: An iterable of documents to insert
+    :return: The list of _id of the inserted documents
+    """
+    docs = list(docs)
+    if not docs:
+        return []
+    result = mongo_collection.insert_many(docs, ordered=False)
+    return result.inserted_ids
+
+
+def bulk_write(mongo_collection, ops):
+    """
+    Sends a mix of write operations to a MongoDB collection at once.
+
+    :param mongo_collection: A pymongo collection object
+    :param ops: A list of pymongo write operations (InsertOne, UpdateOne...)
+    :return: The pymongo BulkWriteResult
+    """
+    return mongo_collection.bulk_write(ops, ordered=False)
+
+
 def insert_school(mongo_collection, **kwargs):
     """
     Inserts a new document in a MongoDB collection.
@@ -12,6 +38,4 @@ def insert_school(mongo_collection, **kwargs):
     :param kwargs: Key-value pairs to be added as document fields
     :return: The _id of the inserted document
     """
-    result = mongo_collection.insert_one(kwargs)
-    return result.inserted_id
-
+    return insert_schools(mongo_collection, [kwargs])[0]
@@ -3,11 +3,13 @@
 
 Cache = __import__('exercise').Cache
 
-cache = Cache()
+cache = Cache(clear=True)
 
 cache.store(b"first")
+cache.flush()
 print(cache.get(cache.store.__qualname__))
 
 cache.store(b"second")
 cache.store(b"third")
+cache.flush()
 print(cache.get(cache.store.__qualname__))
@@ -3,7 +3,7 @@
 
 Cache = __import__('exercise').Cache
 
-cache = Cache()
+cache = Cache(clear=True)
 
 s1 = cache.store("first")
 print(s1)
@@ -12,8 +12,11 @@ print(s2)
 s3 = cache.store("third")
 print(s3)
 
-inputs = cache._redis.lrange("{}:inputs".format(cache.store.__qualname__), 0, -1)
-outputs = cache._redis.lrange("{}:outputs".format(cache.store.__qualname__), 0, -1)
+cache.flush()
+calls = cache._redis.xrange("{}:calls".format(cache.store.__qualname__))
+
+inputs = [fields[b"in"] for _, fields in calls]
+outputs = [fields[b"out"] for _, fields in calls]
 
 print("inputs: {}".format(inputs))
 print("outputs: {}".format(outputs))
@@ -4,7 +4,7 @@
 from exercise import Cache, replay
 
 def main():
-    cache = Cache()
+    cache = Cache(clear=True)
 
     s1 = cache.store("foo")
     print(s1)
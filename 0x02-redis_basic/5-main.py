@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+""" Main file """
+
+from exercise import Cache
+
+def main():
+    cache = Cache(clear=True)
+
+    values = [b"foo", "bar", 42, 3.5]
+    keys = cache.store_many(values)
+    print(keys)
+    assert len(keys) == len(values), f"Expected {len(values)} keys"
+
+    retrieved = [cache.get(key) for key in keys]
+    expected = [b"foo", b"bar", 42, 3.5]
+    assert retrieved == expected, f"Expected {expected} but got {retrieved}"
+
+    cache.flush()
+    count = cache.get(cache.store.__qualname__)
+    assert count == b"4", f"Expected b'4' but got {count}"
+    print(f"Cache.store counter: {count}")
+
+    calls = cache._redis.xrange("{}:calls".format(cache.store.__qualname__))
+    inputs = [fields[b"in"] for _, fields in calls]
+    outputs = [fields[b"out"].decode("utf-8") for _, fields in calls]
+    expected = [repr((value,)).encode("utf-8") for value in values]
+    assert inputs == expected, f"Expected {expected} but got {inputs}"
+    assert outputs == keys, f"Expected {keys} but got {outputs}"
+    print(f"inputs: {inputs}")
+    print(f"outputs: {outputs}")
+
+    number = cache.get_int(keys[2])
+    assert number == 42, f"Expected 42 but got {number}"
+    text = cache.get_str(keys[1])
+    assert text == "bar", f"Expected bar but got {text}"
+    calls = cache.get_int(cache.store.__qualname__)
+    assert calls == 4, f"Expected 4 but got {calls}"
+    missing = cache.get_int("missing")
+    assert missing is None, f"Expected None but got {missing}"
+    print(f"get_int: {number}, get_str: {text}, calls: {calls}")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,265 @@
 #!/usr/bin/env python3
 '''A module for using the Redis NoSQL data storage.
 '''
-import uuid
+import os
+import sys
+import atexit
+import queue
 import redis
+import struct
+import threading
+from collections import OrderedDict
 from functools import wraps
-from typing import Any, Callable, Union, Optional
+from typing import Any, Callable, Iterable, List, Union, Optional
+
+
+# Connection pool shared by every Cache instance. redis-py parses replies
+# with the hiredis C extension on its own whenever it is installed.
+_POOL = redis.ConnectionPool(host='localhost', port=6379, max_connections=32)
+
+# Maximum number of queued commands sent in a single pipeline.
+_FLUSH_BATCH = 512
+
+# Maximum number of values kept in a Cache's local LRU.
+_LRU_SIZE = 1024
+
+# Bumped whenever a Cache of this process clears the database, telling
+# every Cache to drop its local LRU.
+_lru_generation = 0
+
+# Marker starting every number written by _encode, followed by a type
+# tag. A NUL byte never starts the text values other clients store.
+_MARK = b'\x00'
+
+# Payload length of each type tag, None when it is variable.
+_TAG_SIZES = {b'I': 8, b'F': 8, b'N': None}
+
+
+def _encode(data: Union[str, bytes, int, float]) -> bytes:
+    '''Serializes a value for storage in Redis.
+
+    Strings and bytes are stored exactly as redis-py would store them.
+    Integers and floats are stored as _MARK and a type tag followed by
+    fixed width big-endian binary, except for integers too large for 64
+    bits which are kept as decimal text.
+
+    Args:
+        data: The value to serialize.
+
+    Returns:
+        bytes: The payload.
+
+    Raises:
+        TypeError: If data is not a string, bytes, int or float.
+    '''
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, str):
+        return data.encode('utf-8')
+    if isinstance(data, int):
+        try:
+            return _MARK + b'I' + struct.pack('>q', data)
+        except struct.error:
+            return _MARK + b'N' + str(data).encode('ascii')
+    if isinstance(data, float):
+        return _MARK + b'F' + struct.pack('>d', data)
+    raise TypeError('cannot store a value of type {}'.format(
+        type(data).__name__))
+
+
+def _is_tagged(payload: bytes) -> bool:
+    '''Tells whether a payload is a number written by _encode.
+
+    Args:
+        payload: The raw value read from Redis.
+
+    Returns:
+        bool: True if the payload has the marker, a known type tag and a
+        matching length.
+    '''
+    if payload[:1] != _MARK or payload[1:2] not in _TAG_SIZES:
+        return False
+    size = _TAG_SIZES[payload[1:2]]
+    return size is None or len(payload) == 2 + size
+
+
+def _decode(payload: bytes) -> Union[str, bytes, int, float]:
+    '''Deserializes a payload produced by _encode.
+
+    Payloads other than tagged numbers, such as stored strings and bytes
+    or the call counters, are returned unchanged as bytes.
+
+    Args:
+        payload: The raw value read from Redis.
+
+    Returns:
+        The original value.
+    '''
+    if not _is_tagged(payload):
+        return payload
+    tag = payload[1:2]
+    if tag == b'I':
+        return struct.unpack_from('>q', payload, 2)[0]
+    if tag == b'F':
+        return struct.unpack_from('>d', payload, 2)[0]
+    return int(payload[2:])
+
+
+# Applies a burst of recorded calls as one atomic server-side command.
+# Each KEYS[i] comes with three ARGV slots: the operation, then either the
+# increment and a filler, or the input and output of a stream entry.
+_RECORD_LUA = '''
+for i, key in ipairs(KEYS) do
+    local op, a, b = ARGV[3 * i - 2], ARGV[3 * i - 1], ARGV[3 * i]
+    if op == 'incrby' then
+        redis.call('INCRBY', key, a)
+    else
+        redis.call('XADD', key, '*', 'in', a, 'out', b)
+    end
+end
+return #KEYS
+'''
+
+
+def _flush_loop(commands: queue.Queue, redis_store: redis.Redis) -> None:
+    '''Sends queued calls to Redis in bursts, forever.
+
+    Every burst is a single EVALSHA of _RECORD_LUA, so the call counters
+    and the call history are always updated together.
+
+    Args:
+        commands: The queue of (operation, key, a, b) tuples to send.
+        redis_store: The Redis client the commands are sent through.
+    '''
+    record = redis_store.register_script(_RECORD_LUA)
+    while True:
+        batch = [commands.get()]
+        while len(batch) < _FLUSH_BATCH:
+            try:
+                batch.append(commands.get_nowait())
+            except queue.Empty:
+                break
+        keys, argv = [], []
+        for op, key, a, b in batch:
+            keys.append(key)
+            argv.extend((op, a, b))
+        try:
+            record(keys=keys, args=argv)
+        except redis.RedisError:
+            # The tracked counters and history are advisory, so a failed
+            # burst is dropped rather than stopping the thread.
+            pass
+        finally:
+            for _ in batch:
+                commands.task_done()
+
+
+# Calls recorded by the tracking decorators, for every Cache instance.
+_CALLS = queue.Queue()
+
+# Seconds the interpreter waits at exit for the recorded calls to be sent.
+_EXIT_TIMEOUT = 5
+
+# The single thread sending _CALLS to Redis, started by the first Cache.
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _start_flusher() -> None:
+    '''Starts the thread sending the recorded calls, unless it is running.
+    '''
+    global _flusher
+    with _flusher_lock:
+        if _flusher is not None and _flusher.is_alive():
+            return
+        _flusher = threading.Thread(
+            target=_flush_loop,
+            args=(_CALLS, redis.Redis(connection_pool=_POOL)),
+            daemon=True,
+        )
+        _flusher.start()
+
+
+def _restart_flusher_in_child() -> None:
+    '''Replaces the flusher state inherited through os.fork().
+
+    Only the forking thread survives in the child, so the child gets a
+    fresh queue, leaving the calls recorded before the fork to the parent,
+    and its own thread if the parent had one.
+    '''
+    global _CALLS, _flusher, _flusher_lock
+    had_flusher = _flusher is not None
+    _CALLS = queue.Queue()
+    _flusher = None
+    _flusher_lock = threading.Lock()
+    if had_flusher:
+        _start_flusher()
+
+
+def _drain_at_exit() -> None:
+    '''Gives the recorded calls up to _EXIT_TIMEOUT seconds to be sent.
+
+    The daemon flusher thread dies with the interpreter, so this runs first
+    without hanging the exit when Redis is unreachable.
+    '''
+    with _CALLS.all_tasks_done:
+        _CALLS.all_tasks_done.wait_for(
+            lambda: not _CALLS.unfinished_tasks, _EXIT_TIMEOUT
+        )
+
+
+atexit.register(_drain_at_exit)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_flusher_in_child)
+
+
+def _counter_key(qualname: str) -> bytes:
+    '''Returns the key of the call counter of a method.
+    '''
+    return qualname.encode('utf-8')
+
+
+def _calls_key(qualname: str) -> bytes:
+    '''Returns the key of the stream holding the calls of a method.
+    '''
+    return '{}:calls'.format(qualname).encode('utf-8')
+
+
+def _dump_args(args: tuple) -> bytes:
+    '''Serializes the positional arguments of a call for its history.
+
+    The repr is stored as is and never evaluated back, and the stream
+    entry keeps its length, so no delimiter or escaping is needed.
+    '''
+    return repr(args).encode('utf-8')
+
+
+def _record_count(counter_key: bytes, count: int) -> None:
+    '''Queues an increment of a call counter.
+
+    Args:
+        counter_key: The key from _counter_key.
+        count: The number of calls to add.
+    '''
+    _CALLS.put(('incrby', counter_key, count, b''))
+
+
+def _record_call(calls_key: bytes, inputs: bytes, output: Any) -> None:
+    '''Queues a call history entry.
+
+    Args:
+        calls_key: The key from _calls_key.
+        inputs: The arguments serialized by _dump_args.
+        output: The value returned by the call, stored as text unless it
+        is bytes.
+    '''
+    # Hand redis-py bytes, which it sends as is, so no value it would
+    # reject (such as None) can make the whole burst fail
+    if isinstance(output, bytes):
+        out = output
+    else:
+        out = str(output).encode('utf-8')
+    _CALLS.put(('xadd', calls_key, inputs, out))
 
 
 def count_calls(method: Callable) -> Callable:
@@ -16,6 +271,9 @@ def count_calls(method: Callable) -> Callable:
     Returns:
         Callable: The wrapped method.
     '''
+    qualname = method.__qualname__
+    counter_key = _counter_key(qualname)
+
     @wraps(method)
     def invoker(self, *args, **kwargs) -> Any:
         '''Invokes the given method after incrementing its call counter.
@@ -28,8 +286,7 @@ def count_calls(method: Callable) -> Callable:
         Returns:
             Any: The result of the method call.
         '''
-        if isinstance(self._redis, redis.Redis):
-            self._redis.incr(method.__qualname__)
+        _record_count(counter_key, 1)
         return method(self, *args, **kwargs)
     return invoker
 
@@ -37,24 +294,18 @@ def count_calls(method: Callable) -> Callable:
 def call_history(method: Callable) -> Callable:
     '''Tracks the call details of a method in a Cache class.
     '''
+    # Create the key of the stream holding one entry per call
+    qualname = method.__qualname__
+    calls_key = _calls_key(qualname)
+
     @wraps(method)
     def invoker(self, *args, **kwargs) -> Any:
         '''Returns the method's output after storing its inputs and output.
         '''
-        # Create keys for input and output storage
-        in_key = '{}:inputs'.format(method.__qualname__)
-        out_key = '{}:outputs'.format(method.__qualname__)
-
-        # Store input in Redis
-        if isinstance(self._redis, redis.Redis):
-            self._redis.rpush(in_key, str(args))
-
-        # Call the method and store its output
+        # Call the method and queue its input and output as one entry
+        inputs = _dump_args(args)
         output = method(self, *args, **kwargs)
-
-        # Store output in Redis
-        if isinstance(self._redis, redis.Redis):
-            self._redis.rpush(out_key, output)
+        _record_call(calls_key, inputs, output)
 
         return output
     return invoker
@@ -62,40 +313,157 @@ def call_history(method: Callable) -> Callable:
 
 class Cache:
     """
-    A class for storing and retrieving data from Redis using UUIDs as keys.
+    A class for storing and retrieving data from Redis using random hex keys.
+
+    Stored values are kept in a local LRU, dropped whenever a Cache of the
+    same process clears the database. Keys deleted, expired or flushed by
+    anything else may still be returned from it until they are evicted.
 
     Attributes:
         self._redis (redis.Redis): A Redis client instance.
+        self._cache (OrderedDict): The most recently used stored values,
+        by key.
+        self._lock (threading.Lock): Guards self._cache across threads.
+        self._generation (int): The _lru_generation self._cache holds
+        values of.
 
     Methods:
-        __init__(): Initialize a Redis client instance and clear the database.
-        store(data): Store the data in Redis with a UUID key and
+        __init__(clear): Initialize a Redis client instance and optionally
+        clear the database.
+        flush(): Wait until the recorded calls have been sent to Redis.
+        store(data): Store the data in Redis with a random key and
         return the key.
+        store_many(values): Store several values at once and return
+        their keys.
+        get(key, fn): Retrieve a value, optionally transformed by fn.
+        get_str(key): Retrieve a value as a string.
+        get_int(key): Retrieve a value as an integer.
     """
 
-    def __init__(self):
+    def __init__(self, clear: bool = False):
+        """
+        Initialize a Redis client instance backed by the shared pool.
+
+        Args:
+            clear: Whether to flush the database. Off by default since the
+            pool, and so the database, is shared with other instances.
+            The keys are freed in a background Redis thread.
         """
-        Initialize a Redis client instance and clear the database.
+        global _lru_generation
+        self._redis = redis.Redis(connection_pool=_POOL)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        _start_flusher()
+        if clear:
+            # Send the calls other instances recorded, or they would land
+            # after the wipe
+            self.flush()
+            self._redis.flushdb(asynchronous=True)
+            _lru_generation += 1
+        self._generation = _lru_generation
+
+    def flush(self) -> None:
         """
-        self._redis = redis.Redis()
-        self._redis.flushdb()
+        Wait until the recorded calls have been sent to Redis.
+        """
+        # Never wait on a thread that died from an unexpected error
+        _start_flusher()
+        _CALLS.join()
+
+    def _remember(self, key: str, value: Any) -> None:
+        """
+        Records a value in the local LRU, evicting the least recently used.
+
+        Args:
+            key: The key of the value.
+            value: The decoded value.
+        """
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            if len(self._cache) > _LRU_SIZE:
+                self._cache.popitem(last=False)
 
     @count_calls
     @call_history
     def store(self, data: Union[str, bytes, int, float]) -> str:
         """
-        Store the data in Redis with a UUID key and return the key.
+        Store the data in Redis with a random key and return the key.
 
         Args:
             data: The data to be stored. Can be a string, bytes, int, or float.
 
         Returns:
-            str: The UUID key used to store the data.
+            str: The 32 hex digit key used to store the data.
         """
-        key = str(uuid.uuid4())
-        self._redis.set(key, data)
+        key = os.urandom(16).hex()
+        payload = _encode(data)
+        self._redis.set(key, payload)
+        # Cache what a read from Redis would return, e.g. 1 for True
+        self._remember(key, _decode(payload))
         return key
 
+    def store_many(
+        self, values: Iterable[Union[str, bytes, int, float]]
+    ) -> List[str]:
+        """
+        Store several values in Redis with a single MSET and return the keys.
+
+        The calls are tracked as if store had been called once per value.
+
+        Args:
+            values: The data to be stored.
+
+        Returns:
+            list: The keys used to store the values, in order.
+        """
+        values = list(values)
+        keys = [os.urandom(16).hex() for _ in values]
+        if not values:
+            return keys
+        payloads = [_encode(value) for value in values]
+        self._redis.mset(dict(zip(keys, payloads)))
+        qualname = self.store.__qualname__
+        _record_count(_counter_key(qualname), len(values))
+        calls_key = _calls_key(qualname)
+        for key, value, payload in zip(keys, values, payloads):
+            _record_call(calls_key, _dump_args((value,)), key)
+            self._remember(key, _decode(payload))
+        return keys
+
+    def _fetch(self, key: str) -> Optional[Union[str, bytes, int, float]]:
+        """
+        Retrieves and decodes a value, from the local LRU when possible.
+
+        Args:
+            key: The key of the data to be retrieved.
+
+        Returns:
+            The decoded data, or None if the key does not exist.
+        """
+        with self._lock:
+            if self._generation != _lru_generation:
+                # Another Cache cleared the database since
+                self._cache.clear()
+                self._generation = _lru_generation
+            if key in self._cache:
+                # Serve repeated reads from the local LRU
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        data = self._redis.get(key)
+        if data is None:
+            return None
+
+        # Stored numbers are the only values that can be told apart from
+        # mutable ones such as the counters, so only they are remembered
+        # here; store() remembers the strings and bytes it writes itself
+        tagged = _is_tagged(data)
+        data = _decode(data)
+        if tagged:
+            self._remember(key, data)
+        return data
+
     def get(
         self,
         key: str,
@@ -104,15 +472,19 @@ class Cache:
         """
         Retrieves a value from a Redis data storage.
 
+        Call counters are written in the background, so call flush() first
+        to read them up to date. Stored values may come from the local LRU,
+        see Cache.
+
         Args:
             key: The key of the data to be retrieved.
             fn: An optional function to apply to the retrieved data.
 
         Returns:
-            The retrieved data, optionally transformed by the function.
+            The retrieved data, with stored numbers decoded back to int or
+            float, optionally transformed by the function.
         """
-        # Retrieve the data from Redis
-        data = self._redis.get(key)
+        data = self._fetch(key)
 
         # Apply the function to the data (if provided)
         return fn(data) if fn is not None else data
@@ -127,37 +499,35 @@ class Cache:
         Returns:
             The retrieved string value.
         """
-        # Retrieve the data using the get method
-        data = self.get(key)
+        data = self._fetch(key)
 
         # Check if data is None
         if data is None:
             return None
 
-        # Convert data to string and return
+        # Decode bytes as UTF-8, convert anything else to a string
+        if isinstance(data, bytes):
+            return data.decode('utf-8')
         return str(data)
 
+    def get_int(self, key: str) -> Optional[int]:
+        """
+        Retrieves an integer value from a Redis data storage.
 
-def get_int(self, key: str) -> Optional[int]:
-    """
-    Retrieves an integer value from a Redis data storage.
-
-    Args:
-        key: The key of the data to be retrieved.
-
-    Returns:
-        The retrieved integer value.
-    """
+        Args:
+            key: The key of the data to be retrieved.
 
-    # Retrieve the data using the get method
-    data = self.get(key)
+        Returns:
+            The retrieved integer value.
+        """
+        data = self._fetch(key)
 
-    # Check if data is None
-    if data is None:
-        return None
+        # Check if data is None
+        if data is None:
+            return None
 
-    # Convert data to an integer and return
-    return int(data)
+        # Convert data to an integer and return
+        return int(data)
 
 
 def replay(fn: Callable) -> None:
@@ -168,22 +538,30 @@ def replay(fn: Callable) -> None:
     redis_store = getattr(fn.__self__, '_redis', None)
     if not isinstance(redis_store, redis.Redis):
         return
+    fn.__self__.flush()
     fxn_name = fn.__qualname__
-    in_key = '{}:inputs'.format(fxn_name)
-    out_key = '{}:outputs'.format(fxn_name)
-    fxn_call_count = 0
-    if redis_store.exists(fxn_name) != 0:
-        fxn_call_count = int(redis_store.get(fxn_name) or 0)
-    print('{} was called {} times:'.format(fxn_name, fxn_call_count))
-    fxn_inputs = redis_store.lrange(in_key, 0, -1)
-    fxn_outputs = redis_store.lrange(out_key, 0, -1)
-    for fxn_input, fxn_output in zip(fxn_inputs, fxn_outputs):
-        print('{}(*{}) -> {}'.format(
-            fxn_name,
-            fxn_input.decode("utf-8"),
-            fxn_output.decode(
-                "utf-8") if isinstance(fxn_output, bytes) else fxn_output,
-        ))
+    calls_key = _calls_key(fxn_name)
+    pipe = redis_store.pipeline(transaction=False)
+    pipe.get(fxn_name)
+    pipe.xrange(calls_key)
+    fxn_call_count, fxn_calls = pipe.execute()
+    lines = ['{} was called {} times:'.format(
+        fxn_name, int(fxn_call_count or 0)).encode('utf-8')]
+    prefix = '{}(*'.format(fxn_name).encode('utf-8')
+    lines.extend(
+        prefix + fields[b'in'] + b') -> ' + fields[b'out']
+        for _, fields in fxn_calls
+    )
+    output = b'\n'.join(lines) + b'\n'
+    # Emit the whole history with a single write to the underlying stream,
+    # or as text when stdout was replaced by a text-only stream
+    stream = getattr(sys.stdout, 'buffer', None)
+    if stream is None:
+        sys.stdout.write(output.decode('utf-8'))
+        return
+    sys.stdout.flush()
+    stream.write(output)
+    stream.flush()
 
 
 # # Example usage: